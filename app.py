@@ -1,12 +1,15 @@
-import csv
-import math
+import functools
 import os
 import signal
+import threading
 from collections import defaultdict
-from flask import Flask, request, jsonify
+from flask import Flask, request
+import numpy as np
+import orjson
+import pandas as pd
 import datetime
 import random
-import json  # needed to handle JSON serialization
+import json  # fallback for summaries orjson cannot encode
 
 ##############################################################################
 # 1) The Tool class definition (as provided)
@@ -51,122 +54,186 @@ class Tool:
 
 
 ##############################################################################
-# 2) Existing data structures and functions for diagnosis (unchanged)
+# 2) Existing data structures and functions for diagnosis
 ##############################################################################
 
 disease_counts = defaultdict(int)
-disease_symptom_counts = defaultdict(lambda: defaultdict(int))
-disease_symptom_probs = defaultdict(dict)
 all_symptoms = set()
 all_diseases_list = []
 total_cooccurs = 0
 
+# Dense lookup tables built by load_data(): rows follow all_diseases_list,
+# columns follow symptoms_by_index.
+symptoms_by_index = []
+sorted_symptoms = ()  # immutable copy of symptoms_by_index served by list_all_symptoms
+symptom_index = {}
+symptom_probs = np.empty((0, 0), dtype=np.float32)
+log_p = np.empty((0, 0), dtype=np.float32)
+log_1m_p = np.empty((0, 0), dtype=np.float32)
+log_prior = np.empty(0, dtype=np.float32)
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_FILE = os.path.join(BASE_DIR, "symptoms-DO.tsv")
 
+def _parse_count(text):
+    try:
+        return int(text.strip())
+    except ValueError:
+        return 0
+
 def load_data():
-    global total_cooccurs
+    global total_cooccurs, sorted_symptoms, symptom_probs, log_p, log_1m_p, log_prior
+
+    # Start from empty tables so a repeated call reloads instead of appending
+    disease_counts.clear()
+    all_symptoms.clear()
+    all_diseases_list.clear()
+    symptom_index.clear()
 
     print(f"Loading data from {DATA_FILE} ...")
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f, delimiter="\t")
-        for row in reader:
-            # Convert symptom and disease names to lowercase
-            symptom = row["symptom_name"].strip().lower()
-            disease = row["disease_name"].strip().lower()  # if needed
-            try:
-                cooccurs = int(row["cooccurs"].strip())
-            except:
-                cooccurs = 0
-
-            all_symptoms.add(symptom)
-            disease_symptom_counts[disease][symptom] += cooccurs
-            disease_counts[disease] += cooccurs
-            total_cooccurs += cooccurs
-
-            if disease not in all_diseases_list:
-                all_diseases_list.append(disease)
+    df = pd.read_csv(
+        DATA_FILE,
+        sep="\t",
+        usecols=["symptom_name", "disease_name", "cooccurs"],
+        dtype=str,
+        keep_default_na=False,
+    )
+    # Convert symptom and disease names to lowercase
+    df["symptom_name"] = df["symptom_name"].str.strip().str.lower()
+    df["disease_name"] = df["disease_name"].str.strip().str.lower()
+    # Counts follow int() semantics and anything int() rejects ("2.5", "1e3",
+    # "") counts as zero; each distinct string is parsed only once
+    codes, values = pd.factorize(df["cooccurs"])
+    df["cooccurs"] = np.array([_parse_count(v) for v in values], dtype=np.int64)[codes]
+
+    # pd.unique keeps diseases in first-seen order
+    all_diseases_list.extend(pd.unique(df["disease_name"]))
+    all_symptoms.update(df["symptom_name"])
+    total_cooccurs = int(df["cooccurs"].sum())
 
     print(f"Loaded {len(all_diseases_list)} diseases and {len(all_symptoms)} unique symptoms.")
     print("Computing probabilities with Laplace smoothing...")
 
-    num_symptoms = len(all_symptoms)
-    for disease, dcount in disease_counts.items():
-        for symptom in all_symptoms:
-            count = disease_symptom_counts[disease][symptom]
-            prob = (count + 1.0) / (dcount + num_symptoms)
-            disease_symptom_probs[disease][symptom] = prob
-
+    symptoms_by_index[:] = sorted(all_symptoms)
+    sorted_symptoms = tuple(symptoms_by_index)
+    symptom_index.update({s: i for i, s in enumerate(symptoms_by_index)})
+
+    # Dense disease x symptom count matrix scattered from integer codes
+    num_diseases, num_symptoms = len(all_diseases_list), len(symptoms_by_index)
+    disease_codes = pd.Categorical(df["disease_name"], categories=all_diseases_list).codes.astype(np.int64)
+    symptom_codes = pd.Categorical(df["symptom_name"], categories=symptoms_by_index).codes.astype(np.int64)
+    counts = np.bincount(
+        disease_codes * num_symptoms + symptom_codes,
+        weights=df["cooccurs"].to_numpy(dtype=np.float64),
+        minlength=num_diseases * num_symptoms,
+    ).reshape(num_diseases, num_symptoms)
+    dcounts = counts.sum(axis=1)
+    disease_counts.update(zip(all_diseases_list, dcounts.astype(np.int64).tolist()))
+    probs = (counts + 1.0) / (dcounts[:, None] + num_symptoms)
+
+    # Clip once here so the request path needs no epsilons to keep logs finite.
+    probs = np.clip(probs, 1e-12, 1 - 1e-12)
+    symptom_probs = probs.astype(np.float32)
+    log_p = np.log(probs).astype(np.float32)
+    log_1m_p = np.log1p(-probs).astype(np.float32)
+    priors = np.clip(dcounts / max(total_cooccurs, 1), 1e-12, 1.0)
+    log_prior = np.log(priors).astype(np.float32)
+
+    _compute.cache_clear()
     print("Data loading completed.")
 
-def compute_disease_probability(symptom_dict):
-    results = []
-    total_disease_occurrences = sum(disease_counts.values())
-    if total_disease_occurrences == 0:
-        return []
-
-    for disease, count in disease_counts.items():
-        prior_prob = count / total_disease_occurrences
-        import math
-        logp = math.log(prior_prob + 1e-9)
-        for s, val in symptom_dict.items():
-            p_s_given_d = disease_symptom_probs[disease].get(s, 1e-9)
-            if val == 1:
-                logp += math.log(p_s_given_d + 1e-9)
-            else:
-                logp += math.log((1 - p_s_given_d) + 1e-9)
-        results.append((disease, logp))
-
-    max_logp = max(r[1] for r in results)
-    exp_probs = []
-    for (d, lp) in results:
-        exp_probs.append((d, math.exp(lp - max_logp)))
-    sum_exp = sum(x[1] for x in exp_probs)
-    final = []
-    for (d, ep) in exp_probs:
-        prob = ep / (sum_exp if sum_exp else 1e-9)
-        final.append((d, prob))
-
-    final.sort(key=lambda x: x[1], reverse=True)
-    return final
+def compute_disease_probability(symptom_dict, top_n=None):
+    rows, probs = _compute(*_symptom_cols(symptom_dict), top_n)
+    return [(all_diseases_list[r], float(p)) for r, p in zip(rows, probs)]
+
+def _symptom_cols(symptom_dict):
+    # Translate names to column ids once per request. Unknown symptoms shift
+    # every disease equally, so they are dropped here; this also keeps them
+    # out of the cache key.
+    present = frozenset(symptom_index[s] for s, val in symptom_dict.items() if val == 1 and s in symptom_index)
+    absent = frozenset(symptom_index[s] for s, val in symptom_dict.items() if val != 1 and s in symptom_index)
+    return present, absent
+
+# Per-thread scratch vector reused by _compute across requests. It is float64
+# even though the tables are float32: the sums of a few float32 terms are then
+# exact, so diseases with identical inputs tie exactly whatever the column order.
+_scratch = threading.local()
+
+def _score_buffer():
+    buf = getattr(_scratch, "logp", None)
+    if buf is None or buf.shape != log_prior.shape:
+        buf = _scratch.logp = np.empty(log_prior.shape, dtype=np.float64)
+    return buf
+
+@functools.lru_cache(maxsize=2**12)
+def _compute(present, absent, top_n):
+    """
+    Returns (disease rows, probabilities), most likely first, as read-only arrays.
+    """
+    if total_cooccurs == 0 or (top_n is not None and top_n <= 0):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+
+    # Only symptoms the user reported contribute, so accumulating their
+    # columns costs O(D * k) rather than a product over all S symptoms.
+    # Everything up to the final selection runs in place in the scratch buffer.
+    probs = _score_buffer()
+    np.copyto(probs, log_prior)
+    for col in present:
+        np.add(probs, log_p[:, col], out=probs)
+    for col in absent:
+        np.add(probs, log_1m_p[:, col], out=probs)
+    probs -= probs.max()
+    np.exp(probs, out=probs)
+    probs /= probs.sum()
+
+    if top_n is None or top_n >= len(probs):
+        order = np.argsort(-probs, kind="stable")
+    else:
+        # Select the top_n in O(D) and only sort those. Every row tied with
+        # the cutoff value is a candidate, and ties are broken by row order so
+        # equal diseases keep their first-seen order, as a full stable sort would.
+        cutoff = np.partition(probs, len(probs) - top_n)[len(probs) - top_n]
+        candidates = np.flatnonzero(probs >= cutoff)
+        order = candidates[np.lexsort((candidates, -probs[candidates]))][:top_n]
+    # Fancy indexing copies, so the cached result never aliases the buffer
+    probs = probs[order]
+    order.flags.writeable = False
+    probs.flags.writeable = False
+    return order, probs
 
 def suggest_next_symptom(symptom_dict):
-    import math
-    if len(symptom_dict) == len(all_symptoms):
-        return None
+    present, absent = _symptom_cols(symptom_dict)
+    top_rows, _probs = _compute(present, absent, 5)
+    return _next_symptom(top_rows, present | absent)
 
-    top_diseases = compute_disease_probability(symptom_dict)[:5]
-    if not top_diseases:
+def _next_symptom(top_rows, known_cols):
+    if not len(top_rows):
         return None
 
-    top_disease_names = [d for (d, _p) in top_diseases]
-    candidates = [s for s in all_symptoms if s not in symptom_dict]
-
-    best_symptom = None
-    best_variance = -1
-    for s in candidates:
-        values = [disease_symptom_probs[d].get(s, 0.0) for d in top_disease_names]
-        if not values:
-            continue
-        mean = sum(values) / len(values)
-        var = sum((v - mean) ** 2 for v in values) / len(values)
-        if var > best_variance:
-            best_variance = var
-            best_symptom = s
+    # Ask about the symptom whose probability varies most across the top
+    # diseases, skipping the ones the user already answered.
+    variance = symptom_probs[top_rows].var(axis=0)
+    variance[list(known_cols)] = -1.0
 
-    return best_symptom
+    best = int(np.argmax(variance))
+    if variance[best] < 0:
+        return None
+    return symptoms_by_index[best]
 
 def list_all_symptoms_logic():
-    return {"all_symptoms": sorted(all_symptoms)}
+    # Sorted once in load_data(); a tuple so callers cannot reorder the
+    # column list the probability tables are indexed by
+    return {"all_symptoms": sorted_symptoms}
 
 def diagnose_symptoms_logic(symptom_dict):
     # Normalize input keys to lowercase
     symptom_dict = {k.lower(): v for k, v in symptom_dict.items()}
-    ranked = compute_disease_probability(symptom_dict)
+    present, absent = _symptom_cols(symptom_dict)
+    top_rows, top_probs = _compute(present, absent, 5)
     top_5 = []
-    for d, p in ranked[:5]:
-        top_5.append({"disease": d, "probability": p})
-    suggestion = suggest_next_symptom(symptom_dict)
+    for r, p in zip(top_rows, top_probs):
+        top_5.append({"disease": all_diseases_list[r], "probability": float(p)})
+    suggestion = _next_symptom(top_rows, present | absent)
     return {
         "possible_diseases": top_5,
         "next_symptom_suggestions": [suggestion] if suggestion else []
@@ -176,29 +243,27 @@ def diagnose_symptoms_logic(symptom_dict):
 # 3) New Tool: Synthetic Appointment Slot Finder
 ##############################################################################
 
+# Candidate 30-minute start times within work hours, 09:00 through 17:00
+APPOINTMENT_SLOTS = [f"{h:02d}:{m:02d}" for h in range(9, 17) for m in (0, 30)] + ["17:00"]
+
 def available_appointments_logic():
     """
     Generates synthetic appointment slots for the next 2 days.
     Each appointment is 30 minutes long and randomly chosen within work hours (9:00-17:00).
     Returns a dict mapping each date (YYYY-MM-DD) to a list of 2 available time slots.
+    Slots are generated once per calendar day and reused for later calls that day.
     """
-    appointments = {}
-    start_hour = 9
-    end_hour = 17  # appointments can start as late as 16:30
-
-    for day in range(1, 3):
-        date = (datetime.date.today() + datetime.timedelta(days=day)).isoformat()
-        possible_slots = []
-        current_time = datetime.datetime(2000, 1, 1, start_hour, 0)
-        while current_time.hour < end_hour or (current_time.hour == end_hour and current_time.minute == 0):
-            possible_slots.append(current_time.strftime("%H:%M"))
-            current_time += datetime.timedelta(minutes=30)
-            if current_time.hour == end_hour and current_time.minute > 0:
-                break
-
-        chosen_slots = random.sample(possible_slots, 2)
-        appointments[date] = sorted(chosen_slots)
-    return {"appointments": appointments}
+    # The cache holds tuples; each caller gets its own dict and lists
+    slots = _slots_for(datetime.date.today().isoformat())
+    return {"appointments": {date: list(times) for date, times in slots}}
+
+@functools.lru_cache(maxsize=4)
+def _slots_for(today_iso):
+    today = datetime.date.fromisoformat(today_iso)
+    return tuple(
+        ((today + datetime.timedelta(days=day)).isoformat(), tuple(sorted(random.sample(APPOINTMENT_SLOTS, 2))))
+        for day in range(1, 3)
+    )
 
 ##############################################################################
 # 4) New Tool: Save Summary and Transcript to Local File
@@ -220,8 +285,14 @@ def save_summary_logic(summary):
     filename = f"summary_{timestamp}.json"
     
     try:
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(summary, f, indent=4)
+        try:
+            # orjson returns bytes; OPT_NON_STR_KEYS accepts the same keys json.dump did
+            data = orjson.dumps(summary, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            # orjson rejects some values json accepts, e.g. integers beyond 64 bits
+            data = json.dumps(summary, indent=2, ensure_ascii=False).encode("utf-8")
+        with open(filename, "wb") as f:
+            f.write(data)
         return {"message": "Summary saved successfully", "filename": filename}
     except Exception as e:
         return {"error": str(e)}
@@ -271,12 +342,28 @@ ALL_TOOLS = {
     save_summary_tool.name: save_summary_tool
 }
 
+def _dispatcher(tool):
+    # Pull the tool's declared (dict) arguments out of the payload, defaulting to {}
+    names = [arg_name for arg_name, _arg_type in tool.arguments]
+    return lambda args: tool(*[args.get(name, {}) for name in names])
+
+# Webhook dispatch, derived from ALL_TOOLS so the two cannot drift apart
+TOOL_DISPATCH = {name: _dispatcher(tool) for name, tool in ALL_TOOLS.items()}
+
 ##############################################################################
 # 6) Flask Web App: Single webhook endpoint
 ##############################################################################
 
 app = Flask(__name__)
 
+def _json(obj, status=200):
+    # orjson serializes in C and handles NumPy scalars/arrays natively
+    return app.response_class(
+        orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+        status=status,
+        mimetype="application/json",
+    )
+
 @app.route("/webhook/tools", methods=["POST"])
 def handle_tool_webhook():
     """
@@ -298,27 +385,22 @@ def handle_tool_webhook():
     arguments = data.get("arguments", {})
 
     if not tool_name:
-        return jsonify({"error": "No tool_name provided"}), 400
-    if tool_name not in ALL_TOOLS:
-        return jsonify({"error": f"Unknown tool: {tool_name}"}), 400
+        return _json({"error": "No tool_name provided"}, 400)
+    handler = TOOL_DISPATCH.get(tool_name)
+    if handler is None:
+        return _json({"error": f"Unknown tool: {tool_name}"}, 400)
 
-    tool = ALL_TOOLS[tool_name]
     try:
-        if tool_name == "diagnose_symptoms":
-            symptom_dict = arguments.get("symptom_dict", {})
-            result = tool(symptom_dict)
-        elif tool_name == "list_all_symptoms":
-            result = tool()
-        elif tool_name == "available_appointments":
-            result = tool()
-        elif tool_name == "save_summary":
-            summary = arguments.get("summary", {})
-            result = tool(summary)
-        else:
-            result = tool(**arguments)
-        return jsonify(result)
+        return _json(handler(arguments))
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return _json({"error": str(e)}, 500)
+
+@app.route("/debug/cache_info", methods=["GET"])
+def handle_cache_info():
+    """
+    Reports hit/miss counters of the diagnosis cache, useful for tuning its maxsize.
+    """
+    return _json(_compute.cache_info()._asdict())
 
 ##############################################################################
 # 7) App Entry Point